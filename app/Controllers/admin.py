@@ -1,5 +1,7 @@
-from datetime import datetime
-from io import BytesIO
+import asyncio
+import hashlib
+import struct
+from datetime import datetime, timezone
 from pathlib import PurePath
 from typing import Annotated
 from uuid import UUID
@@ -41,14 +43,20 @@ async def delete_image(
 
     if config.storage.method.enabled:  # local image
         if point.local:
-            image_files = [itm[0] async for itm in
-                           services.storage_service.active_storage.list_files("", f"{point.id}.*")]
-            assert len(image_files) <= 1
-            if not image_files:
+            if point.format is not None:
+                # The format is known since indexing, so the file can be located directly without listing the folder
+                image_file = PurePath(f"{point.id}.{point.format}")
+                if not await services.storage_service.active_storage.is_exist(image_file):
+                    image_file = None
+            else:  # Legacy items without format information
+                image_file = await anext(
+                    (itm[0] async for itm in services.storage_service.active_storage.list_files("", f"{point.id}.*")),
+                    None)
+            if image_file is None:
                 logger.warning("Image {} is a local image but not found in static folder.", point.id)
             else:
-                await services.storage_service.active_storage.move(image_files[0], f"_deleted/{image_files[0].name}")
-                logger.success("Image {} removed.", image_files[0].name)
+                await services.storage_service.active_storage.move(image_file, f"_deleted/{image_file.name}")
+                logger.success("Image {} removed.", image_file.name)
         if point.thumbnail_url is not None and (point.local or point.local_thumbnail):
             thumbnail_file = PurePath(f"thumbnails/{point.id}.webp")
             if await services.storage_service.active_storage.is_exist(thumbnail_file):
@@ -91,6 +99,8 @@ async def update_image(image_id: Annotated[UUID, params.Path(description="The id
     return NekoProtocol(message="Image updated.")
 
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 IMAGE_MIMES = {
     "image/jpeg": "jpeg",
     "image/png": "png",
@@ -116,32 +126,48 @@ async def upload_image(image_file: Annotated[UploadFile, File(description="The i
         logger.warning("Failed to infer image format of the uploaded image. Content Type: {}, Filename: {}",
                        image_file.content_type, image_file.filename)
         raise HTTPException(415, "Unsupported image format.")
-    img_bytes = await image_file.read()
+    # Hash the uploaded file chunk by chunk, so the ID is ready once the stream ends without reading it as a whole
+    hasher = hashlib.sha1()
+    while chunk := await image_file.read(UPLOAD_CHUNK_SIZE):
+        # hashlib releases the GIL for large buffers, so hashing in a worker thread won't block other requests
+        await asyncio.to_thread(hasher.update, chunk)
+    img_id = generate_uuid_from_sha1(hasher.hexdigest())
     try:
-        img_id = await services.upload_service.assign_image_id(img_bytes)
+        await services.upload_service.validate_image_id(img_id)
     except PointDuplicateError as ex:
         raise HTTPException(409,
                             f"The uploaded point is already contained in the database! entity id: {ex.entity_id}") \
             from ex
     try:
-        image = Image.open(BytesIO(img_bytes))
-        image.verify()
-        image.close()
-    except UnidentifiedImageError as ex:
-        logger.warning("Invalid image file from upload request. id: {}", img_id)
-        raise HTTPException(422, "Cannot open the image file.") from ex
-
-    mapped_image = MappedImage(id=img_id,
-                               url=model.url,
-                               thumbnail_url=model.thumbnail_url,
-                               local=model.local,
-                               categories=model.categories,
-                               starred=model.starred,
-                               comments=model.comments,
-                               format=img_type,
-                               index_date=datetime.now())
-
-    await services.upload_service.queue_upload_image(mapped_image, img_bytes, model.skip_ocr, model.local_thumbnail)
+        try:
+            # UploadFile is already backed by a spooled temporary file, so PIL can read it directly
+            await image_file.seek(0)
+            image = Image.open(image_file.file)
+            image.verify()
+            image.close()
+        except (UnidentifiedImageError, OSError, SyntaxError, struct.error) as ex:
+            # verify() reports truncated or corrupted files with OSError, SyntaxError or struct.error
+            logger.warning("Invalid image file from upload request. id: {}", img_id)
+            raise HTTPException(422, "Cannot open the image file.") from ex
+        await image_file.seek(0)
+        img_bytes = await image_file.read()
+
+        mapped_image = MappedImage(id=img_id,
+                                   url=model.url,
+                                   thumbnail_url=model.thumbnail_url,
+                                   local=model.local,
+                                   categories=model.categories,
+                                   starred=model.starred,
+                                   comments=model.comments,
+                                   format=img_type,
+                                   index_date=datetime.now(timezone.utc))
+
+        await services.upload_service.queue_upload_image(mapped_image, img_bytes, model.skip_ocr,
+                                                         model.local_thumbnail)
+    except BaseException:
+        # The ID is claimed until the upload worker finishes it, so release it if the image never got queued
+        services.upload_service.release_image_id(img_id)
+        raise
     return ImageUploadResponse(message="OK. Image added to upload queue.", image_id=img_id)
 
 
@@ -1,9 +1,13 @@
-from io import BytesIO
+import asyncio
+import os
 from typing import Annotated, List
 from uuid import uuid4, UUID
 
+import numpy as np
 from PIL import Image
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.params import File, Query, Path, Depends
 from loguru import logger
 
@@ -13,8 +17,8 @@ from app.Models.query_params import SearchPagingParams, FilterParams
 from app.Models.search_result import SearchResult
 from app.Services.authentication import force_access_token_verify
 from app.Services.provider import ServiceProvider
+from app.Services.vector_db_context import VectorDbContext
 from app.config import config
-from app.util.calculate_vectors_cosine import calculate_vectors_cosine
 
 search_router = APIRouter(dependencies=([Depends(force_access_token_verify)] if config.access_protected else None),
                           tags=["Search"])
@@ -58,13 +62,13 @@ async def textSearch(
                         "criteria you have given. This won't take any effect in vision search.")] = False
 ) -> SearchApiResponse:
     logger.info("Text search request received, prompt: {}", prompt)
-    text_vector = services.transformers_service.get_text_vector(prompt) if basis.basis == SearchBasisEnum.vision \
-        else services.transformers_service.get_bert_vector(prompt)
+    text_vector = await (services.transformers_service.get_text_vector_batched(prompt)
+                         if basis.basis == SearchBasisEnum.vision
+                         else services.transformers_service.get_bert_vector_batched(prompt))
     if basis.basis == SearchBasisEnum.ocr and exact:
         filter_param.ocr_text = prompt
     results = await services.db_context.querySearch(text_vector,
-                                                    query_vector_name=services.db_context.vector_name_for_basis(
-                                                        basis.basis),
+                                                    query_vector_name=VectorDbContext.VECTOR_NAME_BY_BASIS[basis.basis],
                                                     filter_param=filter_param,
                                                     top_k=paging.count,
                                                     skip=paging.skip)
@@ -72,17 +76,33 @@ async def textSearch(
         SearchApiResponse(result=results, message=f"Successfully get {len(results)} results.", query_id=uuid4()))
 
 
+IMAGE_SEARCH_MAX_SIZE = 10 * 1024 * 1024
+
+
 @search_router.post("/image", description="Search images by image")
 async def imageSearch(
-        image: Annotated[bytes, File(max_length=10 * 1024 * 1024, media_type="image/*",
-                                     description="The image you want to search.")],
+        image: Annotated[UploadFile, File(media_type="image/*",
+                                          description="The image you want to search. Max size: 10 MiB.")],
         filter_param: Annotated[FilterParams, Depends(FilterParams)],
         paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)]
 ) -> SearchApiResponse:
-    fakefile = BytesIO(image)
-    img = Image.open(fakefile)
+    image_size = image.size
+    if image_size is None:  # The size is unknown, measure the spooled file instead
+        image.file.seek(0, os.SEEK_END)
+        image_size = image.file.tell()
+        image.file.seek(0)
+    if image_size > IMAGE_SEARCH_MAX_SIZE:
+        # Keep the same error as the validation of File(max_length=...) on bytes
+        raise RequestValidationError([{'type': 'bytes_too_long',
+                                       'loc': ('body', 'image'),
+                                       'msg': f'Data should have at most {IMAGE_SEARCH_MAX_SIZE} bytes',
+                                       'input': None,
+                                       'ctx': {'max_length': IMAGE_SEARCH_MAX_SIZE}}])
+    # UploadFile is backed by a spooled temporary file, open it directly instead of copying the content to memory
+    img = Image.open(image.file)
     logger.info("Image search request received")
-    image_vector = services.transformers_service.get_image_vector(img)
+    # Image.open only reads the header, both decoding and inferring happen in the threadpool without blocking the loop
+    image_vector = await run_in_threadpool(services.transformers_service.get_image_vector, img)
     results = await services.db_context.querySearch(image_vector,
                                                     top_k=paging.count,
                                                     skip=paging.skip,
@@ -105,8 +125,8 @@ async def similarWith(
                                                      top_k=paging.count,
                                                      skip=paging.skip,
                                                      filter_param=filter_param,
-                                                     query_vector_name=services.db_context.vector_name_for_basis(
-                                                         basis.basis))
+                                                     query_vector_name=VectorDbContext.VECTOR_NAME_BY_BASIS[
+                                                         basis.basis])
     return await result_postprocessing(
         SearchApiResponse(result=results, message=f"Successfully get {len(results)} results.", query_id=uuid4()))
 
@@ -134,8 +154,7 @@ async def combinedSearch(
                                  "enabled.")
     logger.info("Combined search request received: {}", model)
     result = await process_advanced_and_combined_search_query(model, basis, filter_param, paging, True)
-    calculate_and_sort_by_combined_scores(model, basis, result)
-    result = result[:paging.count] if len(result) > paging.count else result
+    await calculate_and_sort_by_combined_scores(model, basis, result, paging.count)
     return await result_postprocessing(
         SearchApiResponse(result=result, message=f"Successfully get {len(result)} results.", query_id=uuid4()))
 
@@ -164,51 +183,59 @@ async def process_advanced_and_combined_search_query(model: AdvancedSearchModel,
                                                      filter_param: FilterParams,
                                                      paging: SearchPagingParams,
                                                      is_combined_search=False) -> List[SearchResult]:
+    # Submit all the criteria at once so that they are inferred in the same batch, then split them into positive and
+    # negative vectors
     match basis.basis:
         case SearchBasisEnum.ocr:
-            positive_vectors = [services.transformers_service.get_bert_vector(t) for t in model.criteria]
-            negative_vectors = [services.transformers_service.get_bert_vector(t) for t in model.negative_criteria]
+            infer = services.transformers_service.get_bert_vector_batched
         case SearchBasisEnum.vision:
-            positive_vectors = [services.transformers_service.get_text_vector(t) for t in model.criteria]
-            negative_vectors = [services.transformers_service.get_text_vector(t) for t in model.negative_criteria]
+            infer = services.transformers_service.get_text_vector_batched
         case _:  # pragma: no cover
             raise NotImplementedError()
+    all_vectors = await asyncio.gather(*[infer(t) for t in model.criteria + model.negative_criteria])
+    positive_vectors = all_vectors[:len(model.criteria)]
+    negative_vectors = all_vectors[len(model.criteria):]
     # In order to ensure the query effect of the combined query, modify the actual top_k
     _query_top_k = min(max(30, paging.count * 3), 100) if is_combined_search else paging.count
     result = await services.db_context.querySimilar(
-        query_vector_name=services.db_context.vector_name_for_basis(basis.basis),
+        query_vector_name=VectorDbContext.VECTOR_NAME_BY_BASIS[basis.basis],
         positive_vectors=positive_vectors,
         negative_vectors=negative_vectors,
         mode=model.mode,
         filter_param=filter_param,
-        with_vectors=is_combined_search,
         top_k=_query_top_k,
         skip=paging.skip)
     return result
 
 
-def calculate_and_sort_by_combined_scores(model: CombinedSearchModel,
-                                          basis: SearchBasisParams,
-                                          result: List[SearchResult]) -> None:
+async def calculate_and_sort_by_combined_scores(model: CombinedSearchModel,
+                                                basis: SearchBasisParams,
+                                                result: List[SearchResult],
+                                                top_k: int) -> None:
     # Use a different method to calculate the extra prompt vector based on the basis
     match basis.basis:
         case SearchBasisEnum.ocr:
-            extra_prompt_vector = services.transformers_service.get_text_vector(model.extra_prompt)
+            extra_prompt_vector = await services.transformers_service.get_text_vector_batched(model.extra_prompt)
+            extra_vector_name = VectorDbContext.VECTOR_NAME_BY_BASIS[SearchBasisEnum.vision]
         case SearchBasisEnum.vision:
-            extra_prompt_vector = services.transformers_service.get_bert_vector(model.extra_prompt)
+            extra_prompt_vector = await services.transformers_service.get_bert_vector_batched(model.extra_prompt)
+            extra_vector_name = VectorDbContext.VECTOR_NAME_BY_BASIS[SearchBasisEnum.ocr]
         case _:  # pragma: no cover
             raise NotImplementedError()
+    # Let Qdrant calculate the cosine similarities against the stored vectors, so they don't need to be transferred.
+    # Results without extra vector won't be scored by Qdrant, and will keep their original score.
+    similar_scores = await services.db_context.querySimilarityByIds([str(itm.img.id) for itm in result],
+                                                                    extra_prompt_vector,
+                                                                    query_vector_name=extra_vector_name)
     # Calculate combined_similar_score (original score * similar_score) and write to SearchResult.score
-    for itm in result:
-        match basis.basis:
-            case SearchBasisEnum.ocr:
-                extra_vector = itm.img.image_vector
-            case SearchBasisEnum.vision:
-                extra_vector = itm.img.text_contain_vector
-            case _:  # pragma: no cover
-                raise NotImplementedError()
-        if extra_vector is not None:
-            similar_score = calculate_vectors_cosine(extra_vector, extra_prompt_vector)
-            itm.score = (1 + similar_score) * itm.score
-    # Finally, sort the result by combined_similar_score
-    result.sort(key=lambda i: i.score, reverse=True)
+    scores = np.array([itm.score * (1 + similar_scores.get(str(itm.img.id), 0)) for itm in result], dtype=np.float32)
+    # Finally, keep the top_k results sorted by combined_similar_score. Only the top_k items need to be sorted, so
+    # partition them out first if there are more results than that
+    if top_k < len(scores):
+        order = np.argpartition(-scores, top_k - 1)[:top_k]
+        order = order[np.argsort(-scores[order], kind='stable')]
+    else:
+        order = np.argsort(-scores, kind='stable')
+    result[:] = [result[i] for i in order]
+    for itm, score in zip(result, scores[order]):
+        itm.score = float(score)
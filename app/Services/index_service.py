@@ -29,7 +29,8 @@ class IndexService(LifespanService):
         if not skip_ocr and config.ocr_search.enable:
             image_data.ocr_text = self._ocr_service.ocr_interface(image)
             if image_data.ocr_text != "":
-                image_data.text_contain_vector = self._transformers_service.get_bert_vector(image_data.ocr_text)
+                image_data.text_contain_vector = self._transformers_service.get_bert_vector(
+                    image_data.ocr_text, use_cache=False)
             else:
                 image_data.ocr_text = None
 
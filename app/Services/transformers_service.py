@@ -1,4 +1,6 @@
+from hashlib import sha256
 from time import time
+from typing import Callable
 
 import numpy as np
 import torch
@@ -10,6 +12,8 @@ from transformers import CLIPProcessor, CLIPModel, BertTokenizer, BertModel
 
 from app.Services.lifespan_service import LifespanService
 from app.config import config
+from app.util.async_batch_queue import AsyncBatchQueue
+from app.util.lru_cache import LRUCache
 
 
 class TransformersService(LifespanService):
@@ -21,6 +25,9 @@ class TransformersService(LifespanService):
                     self.device, config.model.clip, config.model.bert)
         self._clip_model = CLIPModel.from_pretrained(config.model.clip).to(self.device)
         self._clip_processor = CLIPProcessor.from_pretrained(config.model.clip)
+        # Processors are configured with either the shortest edge or the exact height and width of their input
+        clip_input_size = self._clip_processor.image_processor.size
+        self._clip_input_size: int = clip_input_size.get("shortest_edge", min(clip_input_size.values()))
         logger.success("CLIP Model loaded successfully")
         if config.ocr_search.enable:
             self._bert_model = BertModel.from_pretrained(config.model.bert).to(self.device)
@@ -28,6 +35,14 @@ class TransformersService(LifespanService):
             logger.success("BERT Model loaded successfully")
         else:
             logger.info("OCR search is disabled. Skipping BERT model loading.")
+        self._text_vector_cache: LRUCache[bytes, ndarray] = LRUCache(config.model.text_vector_cache_size)
+        self._bert_vector_cache: LRUCache[bytes, ndarray] = LRUCache(config.model.text_vector_cache_size)
+        self._text_batch_queue: AsyncBatchQueue[str, ndarray] = AsyncBatchQueue(self.get_text_vectors)
+        self._bert_batch_queue: AsyncBatchQueue[str, ndarray] = AsyncBatchQueue(self.get_bert_vectors)
+
+    async def on_exit(self):
+        await self._text_batch_queue.close()
+        await self._bert_batch_queue.close()
 
     @no_grad()
     def get_image_vector(self, image: Image.Image) -> ndarray:
@@ -35,6 +50,13 @@ class TransformersService(LifespanService):
             image = image.convert("RGB")
         logger.info("Processing image...")
         start_time = time()
+        # Shrink large images to the model input size before the processor turns them into arrays, so that it won't
+        # have to convert the full resolution image
+        if min(image.size) > self._clip_input_size:
+            scale = self._clip_input_size / min(image.size)
+            image = image.resize((max(round(image.width * scale), self._clip_input_size),
+                                  max(round(image.height * scale), self._clip_input_size)),
+                                 resample=Image.Resampling.BICUBIC)
         inputs = self._clip_processor(images=image, return_tensors="pt").to(self.device)
         logger.success("Image processed, now Inferring with CLIP model...")
         outputs: FloatTensor = self._clip_model.get_image_features(**inputs)
@@ -42,26 +64,100 @@ class TransformersService(LifespanService):
         outputs /= outputs.norm(dim=-1, keepdim=True)
         return outputs.numpy(force=True).reshape(-1)
 
+    def get_text_vector(self, text: str, use_cache=True) -> ndarray:
+        return self.get_text_vectors([text], use_cache)[0]
+
+    def get_text_vectors(self, texts: list[str], use_cache=True) -> ndarray:
+        """
+        Infer multiple texts with CLIP model in a single batch.
+        :param texts: The texts to infer.
+        :param use_cache: Whether to look up and store the vectors in the text vector cache.
+        :return: A (len(texts), dim) array of the normalized text vectors.
+        """
+        return self._get_vectors_with_cache(self._text_vector_cache, texts, self._infer_text_vectors, use_cache)
+
+    def get_bert_vector(self, text: str, use_cache=True) -> ndarray:
+        return self.get_bert_vectors([text], use_cache)[0]
+
+    def get_bert_vectors(self, texts: list[str], use_cache=True) -> ndarray:
+        """
+        Infer multiple texts with BERT model in a single batch.
+        :param texts: The texts to infer.
+        :param use_cache: Whether to look up and store the vectors in the text vector cache.
+        :return: A (len(texts), dim) array of the text vectors.
+        """
+        return self._get_vectors_with_cache(self._bert_vector_cache, [self._normalize_bert_text(t) for t in texts],
+                                            self._infer_bert_vectors, use_cache)
+
+    async def get_text_vector_batched(self, text: str) -> ndarray:
+        """
+        Infer a text with CLIP model. Concurrent calls will be collected and inferred in a single batch.
+        """
+        cached = self._text_vector_cache.get(self._cache_key(text))
+        if cached is not None:
+            return cached
+        return await self._text_batch_queue.submit(text)
+
+    async def get_bert_vector_batched(self, text: str) -> ndarray:
+        """
+        Infer a text with BERT model. Concurrent calls will be collected and inferred in a single batch.
+        """
+        cached = self._bert_vector_cache.get(self._cache_key(self._normalize_bert_text(text)))
+        if cached is not None:
+            return cached
+        return await self._bert_batch_queue.submit(text)
+
+    @staticmethod
+    def _normalize_bert_text(text: str) -> str:
+        return text.strip().lower()
+
+    @staticmethod
+    def _cache_key(text: str) -> bytes:
+        # Each model has its own cache, so the text digest alone is enough to identify a vector
+        return sha256(text.encode()).digest()[:16]
+
+    @classmethod
+    def _get_vectors_with_cache(cls, cache: LRUCache[bytes, ndarray], texts: list[str],
+                                infer: Callable[[list[str]], ndarray], use_cache: bool) -> ndarray:
+        if not use_cache:
+            return infer(texts)
+        keys = [cls._cache_key(t) for t in texts]
+        found = {k: vec for k in keys if (vec := cache.get(k)) is not None}
+        # Identical texts in a batch (e.g. concurrent requests of the same prompt) are only inferred once
+        missing = {k: t for k, t in zip(keys, texts) if k not in found}
+        if missing:
+            for key, vec in zip(missing, infer(list(missing.values()))):
+                vec = vec.copy()
+                vec.flags.writeable = False
+                cache.put(key, vec)
+                found[key] = vec
+        return np.stack([found[k] for k in keys])
+
     @no_grad()
-    def get_text_vector(self, text: str) -> ndarray:
-        logger.info("Processing text...")
+    def _infer_text_vectors(self, texts: list[str]) -> ndarray:
+        logger.info("Processing {} text(s)...", len(texts))
         start_time = time()
-        inputs = self._clip_processor(text=text, return_tensors="pt").to(self.device)
+        # Texts longer than the CLIP context window would fail the whole batch, so truncate them instead
+        inputs = self._clip_processor(text=texts, padding=True, truncation=True,
+                                      max_length=self._clip_model.config.text_config.max_position_embeddings,
+                                      return_tensors="pt").to(self.device)
         logger.success("Text processed, now Inferring with CLIP model...")
         outputs: FloatTensor = self._clip_model.get_text_features(**inputs)
         logger.success("Inference done. Time elapsed: {:.2f}s", time() - start_time)
         outputs /= outputs.norm(dim=-1, keepdim=True)
-        return outputs.numpy(force=True).reshape(-1)
+        return outputs.numpy(force=True)
 
     @no_grad()
-    def get_bert_vector(self, text: str) -> ndarray:
+    def _infer_bert_vectors(self, texts: list[str]) -> ndarray:
         start_time = time()
-        logger.info("Inferring with BERT model...")
-        inputs = self._bert_tokenizer(text.strip().lower(), return_tensors="pt", truncation=True).to(self.device)
+        logger.info("Inferring {} text(s) with BERT model...", len(texts))
+        inputs = self._bert_tokenizer(texts, padding=True, truncation=True, return_tensors="pt").to(self.device)
         outputs = self._bert_model(**inputs)
-        vector = outputs.last_hidden_state.mean(dim=1).squeeze()
+        # Mean pooling over the non-padding tokens only, so that the results won't be affected by batching
+        mask = inputs['attention_mask'].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+        vectors = (outputs.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1)
         logger.success("BERT inference done. Time elapsed: {:.2f}s", time() - start_time)
-        return vector.cpu().numpy()
+        return vectors.cpu().numpy()
 
     @staticmethod
     def get_random_vector(seed: int | None = None) -> ndarray:
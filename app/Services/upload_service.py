@@ -3,6 +3,7 @@ import gc
 import io
 import pathlib
 from io import BytesIO
+from uuid import UUID
 
 from PIL import Image
 from loguru import logger
@@ -15,6 +16,7 @@ from app.Services.lifespan_service import LifespanService
 from app.Services.storage import StorageService
 from app.Services.vector_db_context import VectorDbContext
 from app.config import config
+from app.util.async_batch_queue import AsyncBatchQueue
 from app.util.generate_uuid import generate_uuid
 
 
@@ -27,6 +29,10 @@ class UploadService(LifespanService):
         self._queue = asyncio.Queue(config.admin_index_queue_max_length)
         self._upload_worker_task = asyncio.create_task(self._upload_worker())
 
+        # Coalesce the duplicate checks of concurrent uploads into a single database request
+        self._validate_queue: AsyncBatchQueue[str, bool] = AsyncBatchQueue(self._validate_ids_batch,
+                                                                         max_batch_size=256, max_wait_time=0.005)
+
         self.uploading_ids = set()
         self._processed_count = 0
 
@@ -41,7 +47,7 @@ class UploadService(LifespanService):
                 logger.exception(ex)
             finally:
                 self._queue.task_done()
-                self.uploading_ids.remove(img_data.id)
+                self.uploading_ids.discard(img_data.id)
                 self._processed_count += 1
                 if self._processed_count % 50 == 0:
                     gc.collect()
@@ -71,14 +77,20 @@ class UploadService(LifespanService):
             logger.success("Image {} uploaded to local storage.", mapped_img.id)
         if gen_thumb:
             logger.info("Start generate and upload thumbnail for {}.", mapped_img.id)
-            img.thumbnail((256, 256), resample=Image.Resampling.LANCZOS)
-            img_byte_arr = BytesIO()
-            img.save(img_byte_arr, 'WebP', save_all=True)
-            await self._storage_service.active_storage.upload(img_byte_arr.getvalue(), thumb_path)
+            # Resizing and encoding are CPU-bound, run them in a worker thread to keep the event loop responsive
+            thumb_bytes = await asyncio.to_thread(self._generate_thumbnail, img)
+            await self._storage_service.active_storage.upload(thumb_bytes, thumb_path)
             logger.success("Thumbnail for {} generated and uploaded!", mapped_img.id)
 
         img.close()
 
+    @staticmethod
+    def _generate_thumbnail(img: Image.Image) -> bytes:
+        img.thumbnail((256, 256), resample=Image.Resampling.LANCZOS)
+        img_byte_arr = BytesIO()
+        img.save(img_byte_arr, 'WebP', save_all=True)
+        return img_byte_arr.getvalue()
+
     async def queue_upload_image(self, mapped_img: MappedImage, img_bytes: bytes, skip_ocr: bool,
                                  thumbnail_mode: UploadImageThumbnailMode):
         self.uploading_ids.add(mapped_img.id)
@@ -86,17 +98,48 @@ class UploadService(LifespanService):
         logger.success("Image {} added to upload queue. Queue Length: {} [+1]", mapped_img.id, self._queue.qsize())
 
     async def assign_image_id(self, img_file: pathlib.Path | io.BytesIO | bytes):
-        img_id = generate_uuid(img_file)
-        # check for duplicate points
-        if img_id in self.uploading_ids or len(await self._db_context.validate_ids([str(img_id)])) != 0:
-            logger.warning("Duplicate upload request for image id: {}", img_id)
-            raise PointDuplicateError(f"The uploaded point is already contained in the database! entity id: {img_id}",
-                                      img_id)
+        img_id = await asyncio.to_thread(generate_uuid, img_file)
+        await self.validate_image_id(img_id)
         return img_id
 
+    async def validate_image_id(self, img_id: UUID):
+        """
+        Check whether the given image ID is available and claim it for uploading. Will raise PointDuplicateError if
+        the ID is already in the upload queue or the database.
+        :param img_id: The image ID to check.
+        """
+        # Claim the ID before waiting for the database, so that concurrent uploads of the same image won't both pass.
+        # The claim is released by the upload worker, or by release_image_id if the upload is rejected later.
+        if img_id not in self.uploading_ids:
+            self.uploading_ids.add(img_id)
+            try:
+                if not await self._validate_queue.submit(str(img_id)):
+                    return
+            except BaseException:
+                self.release_image_id(img_id)
+                raise
+            self.release_image_id(img_id)
+        logger.warning("Duplicate upload request for image id: {}", img_id)
+        raise PointDuplicateError(f"The uploaded point is already contained in the database! entity id: {img_id}",
+                                  img_id)
+
+    def release_image_id(self, img_id: UUID):
+        """
+        Release an image ID claimed by validate_image_id, if the image won't be uploaded.
+        :param img_id: The image ID to release.
+        """
+        self.uploading_ids.discard(img_id)
+
+    async def _validate_ids_batch(self, ids: list[str]) -> list[bool]:
+        valid_ids = set(await self._db_context.validate_ids(ids))
+        return [t in valid_ids for t in ids]
+
     async def sync_upload_image(self, mapped_img: MappedImage, img_bytes: bytes, skip_ocr: bool,
                                 thumbnail_mode: UploadImageThumbnailMode):
-        await self._upload_task(mapped_img, img_bytes, skip_ocr, thumbnail_mode)
+        try:
+            await self._upload_task(mapped_img, img_bytes, skip_ocr, thumbnail_mode)
+        finally:
+            self.release_image_id(mapped_img.id)
 
     def get_queue_size(self):
         return self._queue.qsize()
@@ -106,3 +149,4 @@ class UploadService(LifespanService):
             logger.warning("There are still {} images in the upload queue. Waiting for upload process to be completed.",
                            self.get_queue_size())
         await self._queue.join()
+        await self._validate_queue.close()
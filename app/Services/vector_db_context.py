@@ -26,6 +26,10 @@ class PointNotFoundError(ValueError):
 class VectorDbContext(LifespanService):
     IMG_VECTOR = "image_vector"
     TEXT_VECTOR = "text_contain_vector"
+    VECTOR_NAME_BY_BASIS = {
+        SearchBasisEnum.vision: IMG_VECTOR,
+        SearchBasisEnum.ocr: TEXT_VECTOR,
+    }
     AVAILABLE_POINT_TYPES = models.Record | models.ScoredPoint | models.PointStruct
 
     def __init__(self):
@@ -118,7 +122,6 @@ class VectorDbContext(LifespanService):
                            positive_vectors: Optional[list[numpy.ndarray]] = None,
                            negative_vectors: Optional[list[numpy.ndarray]] = None,
                            mode: Optional[SearchModelEnum] = None,
-                           with_vectors: bool = False,
                            filter_param: FilterParams | None = None,
                            top_k: int = 10,
                            skip: int = 0) -> list[SearchResult]:
@@ -126,16 +129,12 @@ class VectorDbContext(LifespanService):
         _negative_vectors = [t.tolist() for t in negative_vectors] if negative_vectors is not None else None
         _strategy = None if mode is None else (RecommendStrategy.AVERAGE_VECTOR if
                                                mode == SearchModelEnum.average else RecommendStrategy.BEST_SCORE)
-        # since only combined_search need return vectors, We can define _combined_search_need_vectors like below
-        _combined_search_need_vectors = [
-            self.IMG_VECTOR if query_vector_name == self.TEXT_VECTOR else self.TEXT_VECTOR] if with_vectors else None
         logger.info("Querying Qdrant... top_k = {}", top_k)
         result = await self._client.recommend(collection_name=self.collection_name,
                                               using=query_vector_name,
                                               positive=_positive_vectors,
                                               negative=_negative_vectors,
                                               strategy=_strategy,
-                                              with_vectors=_combined_search_need_vectors,
                                               query_filter=self._get_filters_by_filter_param(filter_param),
                                               limit=top_k,
                                               offset=skip,
@@ -144,6 +143,28 @@ class VectorDbContext(LifespanService):
 
         return [self._get_search_result_from_scored_point(t) for t in result]
 
+    async def querySimilarityByIds(self, ids: list[str], query_vector,
+                                   query_vector_name: str = IMG_VECTOR) -> dict[str, float]:
+        """
+        Calculate the similarity scores between the query vector and the stored vectors of the given points.
+        Points without the given vector won't be included in the result.
+        :param ids: The IDs of the points to score.
+        :param query_vector: The vector to compare with.
+        :param query_vector_name: The name of the stored vector to compare with.
+        :return: A dict mapping point ID to its similarity score.
+        """
+        if not ids:
+            return {}
+        logger.info("Scoring {} items in Qdrant...", len(ids))
+        result = await self._client.search(collection_name=self.collection_name,
+                                           query_vector=(query_vector_name, query_vector),
+                                           query_filter=models.Filter(must=[models.HasIdCondition(has_id=ids)]),
+                                           limit=len(ids),
+                                           with_payload=False,
+                                           with_vectors=False)
+        logger.success("Scoring completed!")
+        return {str(t.id): t.score for t in result}
+
     async def insertItems(self, items: list[MappedImage]):
         logger.info("Inserting {} items into Qdrant...", len(items))
 
@@ -214,8 +235,14 @@ class VectorDbContext(LifespanService):
             self.IMG_VECTOR: models.VectorParams(size=768, distance=models.Distance.COSINE),
             self.TEXT_VECTOR: models.VectorParams(size=768, distance=models.Distance.COSINE)
         }
+        # Scalar quantization stores each vector as int8, the search will be done with the quantized vectors and
+        # rescored with the original ones
+        quantization_config = models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        ) if config.qdrant.scalar_quantization else None
         await self._client.create_collection(collection_name=self.collection_name,
-                                             vectors_config=vectors_config)
+                                             vectors_config=vectors_config,
+                                             quantization_config=quantization_config)
         logger.success("Collection created!")
 
     @classmethod
@@ -254,16 +281,6 @@ class VectorDbContext(LifespanService):
     def _get_search_result_from_scored_point(self, point: models.ScoredPoint) -> SearchResult:
         return SearchResult(img=self._get_mapped_image_from_point(point), score=point.score)
 
-    @classmethod
-    def vector_name_for_basis(cls, basis: SearchBasisEnum) -> str:
-        match basis:
-            case SearchBasisEnum.vision:
-                return cls.IMG_VECTOR
-            case SearchBasisEnum.ocr:
-                return cls.TEXT_VECTOR
-            case _:
-                raise ValueError("Invalid basis")
-
     @staticmethod
     def _get_filters_by_filter_param(filter_param: FilterParams | None) -> models.Filter | None:
         if filter_param is None:
@@ -23,6 +23,7 @@ class QdrantSettings(BaseModel):
     coll: str = 'NekoImg'
     prefer_grpc: bool = True
     api_key: str | None = None
+    scalar_quantization: bool = False
 
     local_path: str = './images_metadata'
 
@@ -31,6 +32,7 @@ class ModelsSettings(BaseModel):
     clip: str = 'openai/clip-vit-large-patch14'
     bert: str = 'bert-base-chinese'
     easypaddleocr: str | None = None
+    text_vector_cache_size: int = 4096
 
 
 class OCRSearchSettings(BaseModel):
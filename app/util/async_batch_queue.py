@@ -0,0 +1,105 @@
+import asyncio
+import contextlib
+import inspect
+from typing import Awaitable, Callable, Generic, Sequence, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+from loguru import logger
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class AsyncBatchQueue(Generic[T, R]):
+    """
+    Collect concurrent requests into batches and process each batch with a single call.
+    A batch is processed once it reaches max_batch_size, or max_wait_time seconds after its first item arrived.
+    The process function must return one result for each item. A synchronous process function runs in the threadpool,
+    while a coroutine function is awaited directly. If a batch fails, its items are retried one by one, so only the
+    requests with bad items receive the exception.
+    """
+
+    def __init__(self, process_batch: Callable[[list[T]], Sequence[R] | Awaitable[Sequence[R]]],
+                 max_batch_size=32, max_wait_time=0.008):
+        self._process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self._queue: asyncio.Queue[tuple[T, asyncio.Future]] | None = None
+        self._worker_task: asyncio.Task | None = None
+
+    async def submit(self, item: T) -> R:
+        # The worker is started lazily, since the owner may be created outside a running event loop. It's also
+        # restarted if the owner is used in another event loop later.
+        if self._worker_task is None or self._worker_task.done() \
+                or self._worker_task.get_loop() is not asyncio.get_running_loop():
+            self._queue = asyncio.Queue()
+            self._worker_task = asyncio.create_task(self._worker(self._queue))
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def close(self):
+        """
+        Stop the worker. The requests still waiting for a result will be cancelled.
+        """
+        task, self._worker_task = self._worker_task, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        if task.get_loop() is asyncio.get_running_loop():
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    async def _collect_batch(self, queue: asyncio.Queue, batch: list[tuple[T, asyncio.Future]]):
+        # Fill the given list in place, so the worker can still cancel the collected requests if it's stopped here
+        batch.append(await queue.get())
+        deadline = asyncio.get_running_loop().time() + self.max_wait_time
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _process(self, items: list[T]) -> Sequence[R]:
+        if inspect.iscoroutinefunction(self._process_batch):
+            return await self._process_batch(items)
+        return await run_in_threadpool(self._process_batch, items)
+
+    async def _worker(self, queue: asyncio.Queue):
+        batch: list[tuple[T, asyncio.Future]] = []
+        try:
+            while True:
+                batch = []
+                await self._collect_batch(queue, batch)
+                try:
+                    results = await self._process([item for item, _ in batch])
+                    for (_, future), result in zip(batch, results):
+                        if not future.done():
+                            future.set_result(result)
+                except Exception as ex:
+                    if len(batch) == 1:
+                        logger.exception(ex)
+                        if not batch[0][1].done():
+                            batch[0][1].set_exception(ex)
+                        continue
+                    # Retry the items one by one, so a single bad item won't fail the other requests in its batch
+                    logger.warning("Failed to process a batch of {} items, retrying them one by one: {}",
+                                   len(batch), ex)
+                    for item, future in batch:
+                        try:
+                            result = (await self._process([item]))[0]
+                            if not future.done():
+                                future.set_result(result)
+                        except Exception as item_ex:
+                            logger.exception(item_ex)
+                            if not future.done():
+                                future.set_exception(item_ex)
+        finally:
+            # Don't leave the requests waiting forever once the worker is stopped
+            for _, future in batch:
+                future.cancel()
+            while not queue.empty():
+                queue.get_nowait()[1].cancel()
@@ -0,0 +1,37 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Generic, Hashable, TypeVar
+
+KT = TypeVar('KT', bound=Hashable)
+VT = TypeVar('VT')
+
+
+class LRUCache(Generic[KT, VT]):
+    """
+    A simple bounded mapping which evicts the least recently used item when full.
+    A maxsize of 0 disables the cache. The cache is thread-safe.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[KT, VT] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: KT) -> VT | None:
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: KT, value: VT):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
@@ -22,7 +22,8 @@ async def migrate_v1_v2():
                 point.local = True
             await services.db_context.updatePayload(point)  # This will also store ocr_text_lower field, if present
             if point.ocr_text is not None:
-                point.text_contain_vector = services.transformers_service.get_bert_vector(point.ocr_text_lower)
+                point.text_contain_vector = services.transformers_service.get_bert_vector(point.ocr_text_lower,
+                                                                                          use_cache=False)
 
         logger.info("Updating vectors...")
         # Update vectors for this group of points
@@ -1,5 +1,5 @@
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
 
 import PIL
@@ -23,7 +23,7 @@ async def index_task(file_path: Path, categories: list[str], starred: bool, thum
                                    categories=categories,
                                    starred=starred,
                                    format=file_path.suffix[1:],  # remove the dot
-                                   index_date=datetime.now())
+                                   index_date=datetime.now(timezone.utc))
         await services.upload_service.sync_upload_image(mapped_image, file_path.read_bytes(), skip_ocr=False,
                                                         thumbnail_mode=thumbnail_mode)
     except PointDuplicateError as ex:
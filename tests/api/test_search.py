@@ -55,6 +55,16 @@ def test_search_image(test_client, img_ids):
     assert resp.json()['result'][0]['img']['id'] in img_ids['cat']
 
 
+def test_search_image_too_large(test_client):
+    with open(assets_path / 'test_images' / test_images['cat'][0], 'rb') as f:
+        img_bytes = f.read() + bytes(10 * 1024 * 1024)
+    resp = test_client.post('/search/image',
+                            files={'image': ('cat_0.jpg', img_bytes, 'image/jpeg')})
+
+    assert resp.status_code == 422
+    assert resp.json()['detail'][0]['type'] == 'bytes_too_long'
+
+
 def test_search_similar(test_client, img_ids):
     resp = test_client.get(f"/search/similar/{img_ids['bsn'][0]}")
 
@@ -1,5 +1,6 @@
 import io
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
@@ -87,6 +88,58 @@ async def test_upload_duplicate(test_client, ensure_local_dir_empty, wait_for_ba
     assert resp.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_upload_duplicate_concurrently(test_client, ensure_local_dir_empty, wait_for_background_task):
+    img_bytes = test_file_path.read_bytes()
+
+    def upload(file_bytes, name):
+        return test_client.post('/admin/upload',
+                                files={'image_file': (name, io.BytesIO(file_bytes), 'image/jpeg')},
+                                params={'local': True})
+
+    # Both requests run their duplicate check at the same time, only one of them should be accepted
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        responses = list(executor.map(lambda _: upload(img_bytes, 'bsn_0.jpg'), range(2)))
+    assert sorted(t.status_code for t in responses) == [200, 409]
+    image_id = next(t for t in responses if t.status_code == 200).json()['image_id']
+    await wait_for_background_task(1)
+
+    # The upload worker should still be alive
+    resp = upload(test_file_2_path.read_bytes(), 'bsn_1.jpg')
+    assert resp.status_code == 200
+    image_2_id = resp.json()['image_id']
+    await wait_for_background_task(2)
+
+    # cleanup
+    for t in (image_id, image_2_id):
+        resp = test_client.delete(f'/admin/delete/{t}')
+        assert resp.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_upload_truncated_img_file(test_client, ensure_local_dir_empty, wait_for_background_task):
+    img_bytes = (assets_path / 'test_images' / 'cg_1.png').read_bytes()
+
+    def upload(file_bytes):
+        return test_client.post('/admin/upload',
+                                files={'image_file': ('cg_1.png', io.BytesIO(file_bytes), 'image/png')},
+                                params={'local': True})
+
+    # The truncated file passes Image.open() but fails verify(), its ID should be released afterward
+    for _ in range(2):
+        resp = upload(img_bytes[:len(img_bytes) // 2])
+        assert resp.status_code == 422
+
+    resp = upload(img_bytes)
+    assert resp.status_code == 200
+    image_id = resp.json()['image_id']
+    await wait_for_background_task(1)
+
+    # cleanup
+    resp = test_client.delete(f'/admin/delete/{image_id}')
+    assert resp.status_code == 200
+
+
 TEST_FAKE_URL = 'fake-url'
 TEST_FAKE_THUMBNAIL_URL = 'fake-thumbnail-url'
 
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from app.util.async_batch_queue import AsyncBatchQueue
+
+
+class TestAsyncBatchQueue:
+    @pytest.mark.asyncio
+    async def test_batching(self):
+        batches = []
+
+        def process(items):
+            batches.append(items)
+            return [t * 2 for t in items]
+
+        queue = AsyncBatchQueue(process, max_batch_size=4, max_wait_time=0.05)
+        results = await asyncio.gather(*[queue.submit(i) for i in range(6)])
+        assert results == [0, 2, 4, 6, 8, 10]
+        assert batches == [[0, 1, 2, 3], [4, 5]]
+
+    @pytest.mark.asyncio
+    async def test_exception(self):
+        def process(_):
+            raise ValueError("Process failed.")
+
+        queue = AsyncBatchQueue(process, max_wait_time=0)
+        with pytest.raises(ValueError):
+            await queue.submit(1)
+        # The queue should still work after a failed batch
+        queue._process_batch = lambda items: items  # pylint: disable=protected-access
+        assert await queue.submit(2) == 2
+
+    @pytest.mark.asyncio
+    async def test_exception_in_batch(self):
+        batches = []
+
+        def process(items):
+            batches.append(items)
+            if -1 in items:
+                raise ValueError("Bad item.")
+            return items
+
+        queue = AsyncBatchQueue(process, max_wait_time=0.05)
+        results = await asyncio.gather(queue.submit(1), queue.submit(-1), queue.submit(2), return_exceptions=True)
+        assert results[0] == 1 and results[2] == 2
+        assert isinstance(results[1], ValueError)
+        assert batches == [[1, -1, 2], [1], [-1], [2]]
+
+    @pytest.mark.asyncio
+    async def test_async_process(self):
+        async def process(items):
+            await asyncio.sleep(0)
+            return [t + 1 for t in items]
+
+        queue = AsyncBatchQueue(process, max_wait_time=0.01)
+        assert await asyncio.gather(queue.submit(1), queue.submit(2)) == [2, 3]
+
+    def test_multiple_event_loops(self):
+        queue = AsyncBatchQueue(lambda items: items, max_wait_time=0)
+        assert asyncio.run(queue.submit(1)) == 1
+        assert asyncio.run(queue.submit(2)) == 2
+
+    @pytest.mark.asyncio
+    async def test_close(self):
+        started = asyncio.Event()
+
+        async def process(items):
+            started.set()
+            await asyncio.sleep(10)
+            return items
+
+        queue = AsyncBatchQueue(process, max_batch_size=1, max_wait_time=0)
+        requests = [asyncio.ensure_future(queue.submit(i)) for i in range(2)]
+        await started.wait()
+        worker_task = queue._worker_task  # pylint: disable=protected-access
+        await queue.close()
+        assert worker_task.cancelled()
+        # Both the request being processed and the one still queued are cancelled
+        for request in requests:
+            with pytest.raises(asyncio.CancelledError):
+                await request
+        # The queue starts a new worker when it's used again
+        queue._process_batch = lambda items: items  # pylint: disable=protected-access
+        assert await queue.submit(3) == 3
+        await queue.close()
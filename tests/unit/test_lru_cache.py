@@ -0,0 +1,20 @@
+from app.util.lru_cache import LRUCache
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'a' is now the most recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
@@ -1,7 +1,11 @@
+import asyncio
+
+import numpy as np
+import pytest
 from PIL import Image
 
 from app.Services.transformers_service import TransformersService
-from app.util.calculate_vectors_cosine import calculate_vectors_cosine
+from app.util.lru_cache import LRUCache
 from ..assets import assets_path
 
 
@@ -15,21 +19,122 @@ class TestTransformersService:
         vector2 = self.transformers_service.get_image_vector(Image.open(assets_path / 'test_images/cat_1.jpg'))
         assert vector1.shape == (768,)
         assert vector2.shape == (768,)
-        assert calculate_vectors_cosine(vector1, vector2) > 0.8
+        assert vector1 @ vector2 > 0.8  # CLIP vectors are normalized
+
+    def test_get_image_vector_large_image(self, monkeypatch):
+        image = Image.open(assets_path / 'test_images/cat_0.jpg')
+        image = image.resize((image.width * 4, image.height * 4))
+        vector = self.transformers_service.get_image_vector(image)
+        # Skipping the downscale lets the processor resize the full resolution image itself
+        monkeypatch.setattr(self.transformers_service, '_clip_input_size', max(image.size))
+        assert np.allclose(vector, self.transformers_service.get_image_vector(image), atol=1e-2)
 
     def test_get_text_vector(self):
         vector1 = self.transformers_service.get_text_vector('1girl')
         vector2 = self.transformers_service.get_text_vector('girl, solo')
         assert vector1.shape == (768,)
         assert vector2.shape == (768,)
-        assert calculate_vectors_cosine(vector1, vector2) > 0.8
+        assert vector1 @ vector2 > 0.8  # CLIP vectors are normalized
 
     def test_get_bert_vector(self):
         vector1 = self.transformers_service.get_bert_vector('hi')
         vector2 = self.transformers_service.get_bert_vector('hello')
         assert vector1.shape == (768,)
         assert vector2.shape == (768,)
-        assert calculate_vectors_cosine(vector1, vector2) > 0.8
+        assert vector1 @ vector2 / (np.linalg.norm(vector1) * np.linalg.norm(vector2)) > 0.8
+
+    def test_get_text_vectors_batch(self):
+        vectors = self.transformers_service.get_text_vectors(['1girl', 'a cat sitting on the sofa'], use_cache=False)
+        assert vectors.shape == (2, 768)
+        assert np.allclose(vectors[0], self.transformers_service.get_text_vector('1girl', use_cache=False), atol=1e-5)
+
+    def test_get_bert_vectors_batch(self):
+        vectors = self.transformers_service.get_bert_vectors(['hi', 'The quick brown fox jumps over the lazy dog'],
+                                                             use_cache=False)
+        assert vectors.shape == (2, 768)
+        assert np.allclose(vectors[0], self.transformers_service.get_bert_vector('hi', use_cache=False), atol=1e-5)
+
+    def test_text_vector_cache(self, monkeypatch):
+        service = self.transformers_service
+        monkeypatch.setattr(service, '_text_vector_cache', LRUCache(16))
+        inferred_texts = []
+        infer = service._infer_text_vectors  # pylint: disable=protected-access
+
+        def recording_infer(texts):
+            inferred_texts.append(texts)
+            return infer(texts)
+
+        monkeypatch.setattr(service, '_infer_text_vectors', recording_infer)
+
+        vector = service.get_text_vector('1girl')
+        assert inferred_texts == [['1girl']]
+        # A cache hit won't run the model again
+        assert np.array_equal(service.get_text_vector('1girl'), vector)
+        assert inferred_texts == [['1girl']]
+        # Only the missing texts of a batch are sent to the model
+        vectors = service.get_text_vectors(['1girl', 'girl, solo'])
+        assert inferred_texts == [['1girl'], ['girl, solo']]
+        assert np.array_equal(vectors[0], vector)
+        assert np.allclose(vectors[1], service.get_text_vector('girl, solo', use_cache=False), atol=1e-5)
+
+    @pytest.mark.asyncio
+    async def test_text_vector_dedupe(self, monkeypatch):
+        service = self.transformers_service
+        monkeypatch.setattr(service, '_text_vector_cache', LRUCache(16))
+        inferred_texts = []
+        infer = service._infer_text_vectors  # pylint: disable=protected-access
+
+        def recording_infer(texts):
+            inferred_texts.append(texts)
+            return infer(texts)
+
+        monkeypatch.setattr(service, '_infer_text_vectors', recording_infer)
+
+        vectors = service.get_text_vectors(['1girl', 'girl, solo', '1girl'])
+        assert inferred_texts == [['1girl', 'girl, solo']]
+        assert np.array_equal(vectors[0], vectors[2])
+        # Concurrent requests of the same prompt are inferred only once as well
+        inferred_texts.clear()
+        text = 'a cat sitting on the sofa'
+        vectors = await asyncio.gather(*[service.get_text_vector_batched(text) for _ in range(4)])
+        assert inferred_texts == [[text]]
+        assert all(np.array_equal(t, vectors[0]) for t in vectors)
+
+    @pytest.mark.asyncio
+    async def test_get_text_vector_batched(self):
+        texts = ['1girl', 'girl, solo', 'a cat sitting on the sofa']
+        vectors = await asyncio.gather(*[self.transformers_service.get_text_vector_batched(t) for t in texts])
+        for text, vector in zip(texts, vectors):
+            assert np.allclose(vector, self.transformers_service.get_text_vector(text, use_cache=False), atol=1e-5)
+
+    @pytest.mark.asyncio
+    async def test_get_text_vector_batched_long_text(self):
+        # An overlong prompt is truncated and shouldn't fail the normal prompt sharing its batch
+        long_text = 'The quick brown fox jumps over the lazy dog ' * 100
+        long_vector, vector = await asyncio.gather(self.transformers_service.get_text_vector_batched(long_text),
+                                                   self.transformers_service.get_text_vector_batched('1girl'))
+        assert long_vector.shape == (768,)
+        assert np.allclose(vector, self.transformers_service.get_text_vector('1girl', use_cache=False), atol=1e-5)
+
+    @pytest.mark.asyncio
+    async def test_bert_vector_cache_normalized_text(self, monkeypatch):
+        service = self.transformers_service
+        monkeypatch.setattr(service, '_bert_vector_cache', LRUCache(16))
+        inferred_texts = []
+        infer = service._infer_bert_vectors  # pylint: disable=protected-access
+
+        def recording_infer(texts):
+            inferred_texts.append(texts)
+            return infer(texts)
+
+        monkeypatch.setattr(service, '_infer_bert_vectors', recording_infer)
+
+        vector = service.get_bert_vector('  Hello ')
+        assert inferred_texts == [['hello']]
+        # The same text after stripping and lowercasing should hit the cache, for both the sync and batched methods
+        assert np.array_equal(service.get_bert_vector('HELLO'), vector)
+        assert np.array_equal(await service.get_bert_vector_batched(' hello'), vector)
+        assert inferred_texts == [['hello']]
 
     def test_get_bert_vector_long_text(self):
         vector1 = self.transformers_service.get_bert_vector('The quick brown fox jumps over the lazy dog ' * 100)
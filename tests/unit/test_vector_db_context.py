@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.Models.mapped_image import MappedImage
+from app.Services.vector_db_context import VectorDbContext
+from app.config import config, QdrantMode
+
+
+class TestVectorDbContext:
+    @pytest.mark.asyncio
+    async def test_query_similarity_by_ids(self, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'mode', QdrantMode.MEMORY)
+        db_context = VectorDbContext()
+        await db_context.on_load()
+
+        generator = np.random.default_rng(0)
+        img_with_text = MappedImage(id=uuid4(), index_date=datetime.now(timezone.utc),
+                                    image_vector=generator.uniform(-1, 1, 768).astype(np.float32),
+                                    text_contain_vector=generator.uniform(-1, 1, 768).astype(np.float32))
+        img_without_text = MappedImage(id=uuid4(), index_date=datetime.now(timezone.utc),
+                                       image_vector=generator.uniform(-1, 1, 768).astype(np.float32))
+        await db_context.insertItems([img_with_text, img_without_text])
+        ids = [str(img_with_text.id), str(img_without_text.id)]
+        query_vector = generator.uniform(-1, 1, 768).astype(np.float32)
+
+        def cosine(vector):
+            return vector @ query_vector / (np.linalg.norm(vector) * np.linalg.norm(query_vector))
+
+        # Points without the requested vector are left out
+        scores = await db_context.querySimilarityByIds(ids, query_vector, query_vector_name=VectorDbContext.TEXT_VECTOR)
+        assert scores.keys() == {str(img_with_text.id)}
+        assert scores[str(img_with_text.id)] == pytest.approx(cosine(img_with_text.text_contain_vector), abs=1e-5)
+
+        scores = await db_context.querySimilarityByIds(ids, query_vector, query_vector_name=VectorDbContext.IMG_VECTOR)
+        assert scores.keys() == set(ids)
+        for img in (img_with_text, img_without_text):
+            assert scores[str(img.id)] == pytest.approx(cosine(img.image_vector), abs=1e-5)
+
+        assert await db_context.querySimilarityByIds([], query_vector) == {}